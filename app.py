@@ -4,40 +4,116 @@ Processes commercial invoices and matches HTS codes
 """
 
 from flask import Flask, request, jsonify, send_file, render_template
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+import orjson
 import pandas as pd
+import numpy as np
 import os
 import io
+import logging
 import time
-import glob
+import hashlib
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from datetime import datetime
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-import PyPDF2
+import pypdfium2 as pdfium
 import re
 import pytesseract
-from pdf2image import convert_from_path
 from PIL import Image
 
+# Tesseract's internal OpenMP threading would oversubscribe cores when pages are
+# OCR'd in parallel, so limit each tesseract process to a single thread
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+
+logger = logging.getLogger(__name__)
+
+# PDFium is not thread-safe, so every call into it (opening, reading, rendering and
+# closing documents) is serialised, even across different documents
+_PDFIUM_LOCK = threading.Lock()
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson, which encodes the data samples in responses
+    several times faster than the standard library and handles numpy values directly
+    
+    NaN values are encoded as null (valid JSON) rather than the bare NaN json.dumps emits.
+    """
+    options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+    
+    def dumps(self, obj, **kwargs):
+        options = self.options
+        if kwargs.get('indent'):
+            options |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=options).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 OUTPUT_FOLDER = 'outputs'
-ALLOWED_EXTENSIONS = {'pdf', 'txt', 'csv'}
+# Extracted PDF text, keyed by file content hash (cleaned up with the uploads)
+PDF_TEXT_CACHE_FOLDER = os.path.join(UPLOAD_FOLDER, '.pdf_text_cache')
+ALLOWED_EXTENSIONS = frozenset({'pdf', 'txt', 'csv'})
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+os.makedirs(PDF_TEXT_CACHE_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max request size
+
+# Startup cleanup is skipped if this sentinel shows it ran less than CLEANUP_INTERVAL seconds ago
+CLEANUP_SENTINEL = os.path.join(OUTPUT_FOLDER, '.last_cleanup')
+CLEANUP_INTERVAL = 60 * 60
+
+# Makes invoice numbers safe to use in output filenames
+_SAFE_INVOICE_TRANS = str.maketrans({'/': '-', '\\': '-', ' ': '_'})
+
+# Uploads are copied from the request to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Resolution scanned PDF pages are rendered at for OCR, and for the retry pass when
+# the whole document then has fewer than OCR_RETRY_MIN_PART_CANDIDATES part numbers
+OCR_DPI = 200
+OCR_RETRY_DPI = 300
+OCR_RETRY_MIN_PART_CANDIDATES = 1
+# LSTM engine only (faster than the combined legacy+LSTM mode), page as one text block
+OCR_TESSERACT_CONFIG = '--oem 1 --psm 6'
+# OCR is only run on PDF pages whose text layer has fewer characters than this
+OCR_PAGE_MIN_CHARS = 20
+# PDFs averaging more characters per page than this are treated as born-digital
+DIGITAL_PDF_MIN_AVG_CHARS = 200
+# Pages OCR'd at once; each runs in its own tesseract process
+OCR_WORKERS = os.cpu_count() or 1
+# Number of extracted PDF texts kept in memory, keyed by content hash
+PDF_TEXT_MEMO_SIZE = 128
 
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_upload(file, filepath):
+    """Save an uploaded file in UPLOAD_CHUNK_SIZE chunks (FileStorage.save copies 16 KiB at a time)"""
+    with open(filepath, 'wb') as fp:
+        shutil.copyfileobj(file.stream, fp, length=UPLOAD_CHUNK_SIZE)
+
 
 def cleanup_old_files(directory, days_old=7):
     """
@@ -56,126 +132,448 @@ def cleanup_old_files(directory, days_old=7):
     removed_count = 0
     total_size_removed = 0
     
-    for file_path in glob.glob(os.path.join(directory, '*')):
-        if os.path.isfile(file_path):
-            file_stat = os.stat(file_path)
+    # scandir's entries carry the file type from the directory listing, so each
+    # file costs one stat call; hidden files (.gitkeep, caches) are skipped like glob did
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                continue
+            file_stat = entry.stat(follow_symlinks=False)
             
             # Check if file is older than cutoff
             if file_stat.st_mtime < cutoff_time:
                 file_size = file_stat.st_size
-                os.remove(file_path)
+                os.remove(entry.path)
                 removed_count += 1
                 total_size_removed += file_size
     
     return removed_count, total_size_removed
 
 
+def cleanup_ran_recently():
+    """Check whether startup cleanup ran within CLEANUP_INTERVAL, e.g. before a reloader restart"""
+    try:
+        return time.time() - os.stat(CLEANUP_SENTINEL).st_mtime < CLEANUP_INTERVAL
+    except OSError:
+        return False
+
+
+def mark_cleanup_done():
+    """Record the time of the last startup cleanup in the sentinel file"""
+    with open(CLEANUP_SENTINEL, 'w') as f:
+        f.write(str(int(time.time())))
+
+
+def _ocr_page(image):
+    """OCR a single rendered page image"""
+    return pytesseract.image_to_string(image, lang='eng', config=OCR_TESSERACT_CONFIG)
+
+
+# Set once tesseract turns out not to be installed, so later PDFs keep their text
+# layer instead of rendering pages only for OCR to fail again
+_ocr_unavailable = False
+
+# Shared by all requests and created on first use; threads are enough because
+# tesseract does the work in a subprocess while the thread just waits on it
+_ocr_executor = None
+_OCR_EXECUTOR_LOCK = threading.Lock()
+
+
+def _get_ocr_executor():
+    """Return the shared OCR thread pool, creating it on first use"""
+    global _ocr_executor
+    with _OCR_EXECUTOR_LOCK:
+        if _ocr_executor is None:
+            _ocr_executor = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix='ocr')
+        return _ocr_executor
+
+
+def _render_page(pdf, page_index, dpi):
+    """Render a PDF page to a PIL image at the given DPI"""
+    with _PDFIUM_LOCK:
+        page = pdf[page_index]
+        bitmap = page.render(scale=dpi / 72)
+        # The image from to_pil() can share PDFium's bitmap buffer, which would then be
+        # freed by garbage collection outside the lock; copy it and free PDFium's here
+        image = bitmap.to_pil().copy()
+        bitmap.close()
+        page.close()
+    return image
+
+
+def _ocr_rendered_pages(pdf, page_indexes, dpi):
+    """Render pages in-process with PDFium at the given DPI and OCR them in the shared pool"""
+    # A single page or core gains nothing from the pool
+    if OCR_WORKERS == 1 or len(page_indexes) == 1:
+        return [
+            _ocr_page(_render_page(pdf, page_index, dpi))
+            for page_index in page_indexes
+        ]
+    
+    executor = _get_ocr_executor()
+    ocr_texts = []
+    pending = deque()
+    
+    for page_index in page_indexes:
+        # Bound the rendered pages in flight so memory doesn't grow with page count
+        if len(pending) >= 2 * OCR_WORKERS:
+            ocr_texts.append(pending.popleft().result())
+        image = _render_page(pdf, page_index, dpi)
+        pending.append(executor.submit(_ocr_page, image))
+    
+    ocr_texts.extend(future.result() for future in pending)
+    
+    return ocr_texts
+
+
+def _count_part_candidates(text):
+    """Count raw part-number candidates, used to judge whether OCR output is usable"""
+    return sum(1 for _ in _PART_NUMBER_RE.finditer(text))
+
+
+def _ocr_pdf_pages(pdf, page_indexes, known_candidates=0):
+    """
+    OCR PDF pages at OCR_DPI, retrying them at OCR_RETRY_DPI if the document has too few part numbers
+    
+    Args:
+        pdf: Open pdfium.PdfDocument
+        page_indexes: Zero-based indexes of the pages to OCR
+        known_candidates: Part-number candidates already found in the document's text layer
+        
+    Returns:
+        List of OCR text, in the same order as page_indexes
+    """
+    ocr_texts = _ocr_rendered_pages(pdf, page_indexes, OCR_DPI)
+    
+    # Lower resolution is much faster but can miss small print; only pay for the
+    # slower high-resolution pass when the document as a whole came back without
+    # part numbers, not for every blank, cover or terms page of a good scan
+    counts = [_count_part_candidates(text) for text in ocr_texts]
+    if known_candidates + sum(counts) < OCR_RETRY_MIN_PART_CANDIDATES:
+        logger.info("Retrying %s pages with OCR at %s DPI...", len(page_indexes), OCR_RETRY_DPI)
+        retry_texts = _ocr_rendered_pages(pdf, page_indexes, OCR_RETRY_DPI)
+        for i, text in enumerate(retry_texts):
+            if _count_part_candidates(text) > counts[i]:
+                ocr_texts[i] = text
+    
+    return ocr_texts
+
+
+def file_digest(file_path):
+    """Return a BLAKE2b hash of a file's content, rehashing only when its mtime or size changes"""
+    stat = os.stat(file_path)
+    return _file_digest_cached(file_path, stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=256)
+def _file_digest_cached(file_path, mtime_ns, size):
+    """Hash a file's content (mtime and size are only part of the cache key)"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def extract_text_from_pdf(file_path):
-    """Extract text from PDF file using PyPDF2 first, then OCR if needed"""
+    """
+    Extract text from PDF file, reusing the result for identical file content
+    
+    The same PDF is read while matching files and again while processing them,
+    so results are cached in memory and on disk by content hash to avoid a second OCR pass.
+    """
     try:
-        # First try PyPDF2 for text-based PDFs
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        
-        # If no text was extracted, try OCR
-        if not text.strip():
-            print("No text found with PyPDF2, trying OCR...")
-            try:
-                # Convert PDF to images
-                images = convert_from_path(file_path, dpi=300)
-                ocr_text = ""
-                
-                for i, image in enumerate(images):
-                    print(f"Processing page {i+1}/{len(images)} with OCR...")
-                    # Use OCR to extract text from image
-                    page_text = pytesseract.image_to_string(image, lang='eng')
-                    ocr_text += page_text + "\n"
-                
-                text = ocr_text.strip()
-                print(f"OCR extracted {len(text)} characters")
-                
-            except Exception as ocr_error:
-                print(f"OCR failed: {ocr_error}")
-                return ""
+        digest = file_digest(file_path)
+    except Exception as e:
+        logger.warning("Error extracting PDF text: %s", e)
+        return ""
+    return _extract_text_from_pdf_cached(digest, file_path)
+
+
+# Complete extractions by content hash, least recently used first; the lock keeps
+# lookups and evictions from different request threads apart
+_pdf_text_memo = OrderedDict()
+_PDF_TEXT_MEMO_LOCK = threading.Lock()
+
+
+def is_pdf_text_cached(file_path):
+    """Check whether a PDF's extracted text is already cached in memory or on disk"""
+    try:
+        digest = file_digest(file_path)
+    except OSError:
+        return False
+    return digest in _pdf_text_memo or os.path.exists(
+        os.path.join(PDF_TEXT_CACHE_FOLDER, f"{digest}.txt")
+    )
+
+
+def _extract_text_from_pdf_cached(digest, file_path):
+    """Look up extracted text in memory or on disk by content hash, extracting it on a miss"""
+    with _PDF_TEXT_MEMO_LOCK:
+        text = _pdf_text_memo.get(digest)
+        if text is not None:
+            _pdf_text_memo.move_to_end(digest)
+            return text
+    
+    cache_path = os.path.join(PDF_TEXT_CACHE_FOLDER, f"{digest}.txt")
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as file:
+            text = file.read()
+        if not text:
+            raise ValueError("empty cache file")
+    except FileNotFoundError:
+        text = None
+    except (OSError, UnicodeDecodeError, ValueError) as e:
+        # A truncated or corrupt entry is treated as a miss and replaced below
+        logger.warning("Discarding unreadable PDF text cache file %s: %s", cache_path, e)
+        with suppress(OSError):
+            os.remove(cache_path)
+        text = None
+    
+    if text is None:
+        text, complete = _extract_text_from_pdf_uncached(file_path)
         
-        return text.strip()
+        # Text from a failed or partial OCR run is returned but never cached, so the
+        # next request for the same content tries the missing pages again
+        if not (text and complete):
+            return text
+        try:
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=PDF_TEXT_CACHE_FOLDER,
+                                             suffix='.tmp', delete=False) as file:
+                file.write(text)
+            os.replace(file.name, cache_path)
+        except OSError as e:
+            logger.warning("Could not cache PDF text: %s", e)
+    
+    with _PDF_TEXT_MEMO_LOCK:
+        _pdf_text_memo[digest] = text
+        _pdf_text_memo.move_to_end(digest)
+        if len(_pdf_text_memo) > PDF_TEXT_MEMO_SIZE:
+            _pdf_text_memo.popitem(last=False)
+    return text
+
+
+def _extract_text_from_pdf_uncached(file_path):
+    """
+    Extract text from PDF file using PDFium first, then OCR pages that have no text layer
+    
+    Returns:
+        Tuple of (text, complete); complete is False if reading the PDF or OCR failed,
+        but True when OCR was skipped because tesseract is not installed
+    """
+    global _ocr_unavailable
+    try:
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(file_path)
+        try:
+            # First read the text layer for text-based PDFs (PDFium separates lines with CRLF)
+            with _PDFIUM_LOCK:
+                page_texts = [
+                    page.get_textpage().get_text_range().replace('\r\n', '\n')
+                    for page in pdf
+                ]
+            
+            text = "\n".join(page_texts)
+            
+            # Born-digital PDFs carry plenty of text on average, so skip OCR entirely;
+            # otherwise only OCR the pages whose text layer is missing or nearly empty
+            ocr_pages = []
+            complete = True
+            if page_texts and len(text) / len(page_texts) <= DIGITAL_PDF_MIN_AVG_CHARS:
+                ocr_pages = [
+                    i for i, page_text in enumerate(page_texts)
+                    if len(page_text.strip()) < OCR_PAGE_MIN_CHARS
+                ]
+            
+            if ocr_pages and not _ocr_unavailable:
+                logger.info("No text layer found on %s/%s pages, trying OCR...", len(ocr_pages), len(page_texts))
+                try:
+                    ocr_page_set = set(ocr_pages)
+                    known_candidates = sum(
+                        _count_part_candidates(page_text)
+                        for i, page_text in enumerate(page_texts) if i not in ocr_page_set
+                    )
+                    ocr_texts = _ocr_pdf_pages(pdf, ocr_pages, known_candidates)
+                    
+                    for page_index, ocr_text in zip(ocr_pages, ocr_texts):
+                        page_texts[page_index] = ocr_text
+                    
+                    text = "\n".join(page_texts)
+                    logger.info("OCR extracted %s characters", sum(len(t) for t in ocr_texts))
+                    
+                except pytesseract.TesseractNotFoundError:
+                    # Retrying can't help until tesseract is installed, so the text layer
+                    # is as good as this extraction gets and is safe to cache
+                    logger.warning("tesseract is not installed, PDF pages without a text layer will not be OCR'd")
+                    _ocr_unavailable = True
+                    
+                except Exception as ocr_error:
+                    # Keep whatever the text layer provided
+                    logger.warning("OCR failed: %s", ocr_error)
+                    complete = False
+        finally:
+            with _PDFIUM_LOCK:
+                pdf.close()
+        
+        return text.strip(), complete
         
     except Exception as e:
-        print(f"Error extracting PDF text: {e}")
-        return ""
+        logger.warning("Error extracting PDF text: %s", e)
+        return "", False
 
-def extract_text_from_txt(file_path):
-    """Extract text from TXT file with robust encoding handling"""
-    encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1', 'utf-16', 'utf-32']
+
+# Encodings tried, in order, when decoding uploaded TXT files
+TXT_ENCODINGS = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1', 'utf-16', 'utf-32']
+
+
+def read_text_file(file_path):
+    """
+    Read a TXT file from disk once and decode it with the first encoding that fits
+    
+    Args:
+        file_path: Path to the file
+        
+    Returns:
+        Tuple of (content, encoding); encoding is None if UTF-8 with replacement was needed
+    """
+    with open(file_path, 'rb') as file:
+        raw = file.read()
     
-    for encoding in encodings:
+    for encoding in TXT_ENCODINGS:
         try:
-            with open(file_path, 'r', encoding=encoding) as file:
-                content = file.read().strip()
-                print(f"Successfully read TXT file with {encoding} encoding")
-                return content
-        except (UnicodeDecodeError, UnicodeError) as e:
-            print(f"Failed to read with {encoding}: {e}")
-            continue
+            content = raw.decode(encoding)
+            break
+        except UnicodeError as e:
+            logger.debug("Failed to decode with %s: %s", encoding, e)
+    else:
+        encoding = None
+        content = raw.decode('utf-8', errors='replace')
     
-    # If all encodings fail, try with error handling
+    # Normalize newlines the same way text-mode open() does
+    return content.replace('\r\n', '\n').replace('\r', '\n'), encoding
+
+
+def extract_text_from_txt(file_path):
+    """Extract text from TXT file with robust encoding handling"""
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
-            content = file.read().strip()
-            print("Read TXT file with UTF-8 and error replacement")
-            return content
+        content, encoding = read_text_file(file_path)
+        if encoding:
+            logger.debug("Successfully read TXT file with %s encoding", encoding)
+        else:
+            logger.warning("Read TXT file with UTF-8 and error replacement")
+        return content.strip()
     except Exception as e:
-        print(f"All encoding attempts failed: {e}")
+        logger.warning("All encoding attempts failed: %s", e)
         return ""
 
+
+# Enhanced invoice patterns for your specific format
+INVOICE_PATTERNS = {
+    'invoice_number': [
+        r'(\d{3,}[A-Z]-\d{8,})',  # Pattern like 074M-22005749
+        r'(\d{3,}[A-Z]\d{8,})',   # Pattern like 074M22005749
+        r'Invoice[:\s#]*([A-Z0-9-]+)',
+    ],
+    'invoice_date': [
+        r'(\d{1,2}[A-Za-z]{3}/\d{2}/\d{4})',  # Pattern like 21Oct/2025
+        r'Date[:\s]*([0-9/-]+)',
+    ],
+    'seller_name': [
+        r'([A-Za-z\s&.,]+(?:S\.\s*de\s*RL\s*de\s*CV|INC|CORP|LLC|LTD))',  # Company names
+        r'(?:Seller|From|Exporter)[:\s]*([^\n]+)',
+    ],
+    'buyer_name': [
+        r'(?:Buyer|To|Importer)[:\s]*([^\n]+)',
+    ],
+    'total_amount': [
+        r'Total[:\s]*\$?([0-9,]+\.?[0-9]*)',
+        r'\$([0-9,]+\.?[0-9]*)',  # Any dollar amount
+    ],
+    'currency': [
+        r'Currency[:\s]*([A-Z]{3})',
+        r'\b(USD|MXN|CAD)\b',  # Common currencies
+    ],
+    'country_origin': [
+        r'([A-Z]{2})\s+[A-Z]{3}\s+[A-Z]',  # Pattern like "MX NIO D"
+        r'(?:Country of Origin|Origin)[:\s]*([^\n]+)',
+    ],
+    'country_destination': [
+        r'(?:Country of Destination|Destination)[:\s]*([^\n]+)',
+    ],
+    'terms': [
+        r'(?:Terms|Payment Terms|INCOTERM)[:\s]*([^\n]+)',
+    ],
+}
+
+_INVOICE_PATTERNS = {
+    field: [re.compile(pattern, re.IGNORECASE) for pattern in pattern_list]
+    for field, pattern_list in INVOICE_PATTERNS.items()
+}
+
+# More specific part number patterns based on your actual data
+# (each is matched against whole words only)
+PART_NUMBER_PATTERNS = [
+    r'[A-Z]{2,}\d{4,}',           # Pattern like COMP001, MEM002
+    r'\d{4,}[A-Z]{2,}',           # Pattern like 001COMP, 002MEM
+    r'[A-Z]{1,3}\d{3,6}',         # Pattern like A123, AB1234
+    r'\d{3,6}[A-Z]{1,3}',         # Pattern like 123A, 1234AB
+    # More specific patterns for actual part numbers
+    r'[A-Z]{2,3}\d{3,4}[A-Z]{1,2}',  # Pattern like 214N53, 222A7C
+    r'\d{3,4}[A-Z]{2,3}\d{1,2}',     # Pattern like 253G2M, 2575L7
+]
+
+# Asterisk-prefixed part numbers plus every word pattern as one alternation, so the
+# text is scanned in a single pass; a word is a candidate if any pattern matches it
+_PART_NUMBER_RE = re.compile(
+    r'\*(?P<starred>[A-Z0-9]{6,7})\b'   # Pattern like *214N53, *183NK5
+    r'|\b(?P<word>' + '|'.join(PART_NUMBER_PATTERNS) + r')\b'
+)
+
+# Used to derive invoice number variations that must not be reported as parts
+_INVOICE_NUMERIC_RE = re.compile(r'(\d{8,})')
+_INVOICE_PREFIX_RE = re.compile(r'^(\d{3,}[A-Z]+)')
+
+# Substrings that mark a candidate as a word, unit or document ID rather than a part number
+PART_NUMBER_FALSE_POSITIVES = frozenset([
+    'USD', 'FOB', 'NET', 'TOTAL', 'DATE', 'INVOICE', 'QUANTITY', 'MX', 'US',
+    'PAGE', 'ENTRY', 'PORT', 'VALUE', 'RATE', 'DUTY', 'PACKING', 'WEIGHT',
+    'ORIGIN', 'DESTINATION', 'CURRENCY', 'TERMS', 'PAYMENT', 'FREIGHT',
+    'CARRIER', 'TRUCK', 'CHARGE', 'INCOTERM', 'RECORD', 'IMPORTER',
+    'SUMMARY', 'DESCRIPTION', 'CONTROLLERS', 'SENSOR', 'RELAY', 'FIXTURE',
+    'LIGHTING', 'LIGHT', 'WALL', 'CEILING', 'MOTION', 'OCCUPATION',
+    'PROGRAMMABLE', 'PALLETS', 'BUNDLES', 'PACK', 'UNIT', 'TYPE',
+    'NUMBER', 'PART', 'GROSS', 'LOCAL', 'ESTIMATED', 'PKGS', 'DUTIABLE',
+    'VENDOR', 'BRANDS', 'ACUITY', 'CALIFORNIA', 'TEXAS', 'GEORGIA',
+    'ATLANTA', 'LAREDO', 'GUADALUPE', 'LEON', 'NUEVO', 'ENLACE',
+    'PARQUE', 'PLANTA', 'SILLA', 'LASILLA', 'ARQUE', 'AARQUE',
+    'PEACHTREE', 'SUITE', 'STREET', 'BASE', 'METAL', 'PLASTIC',
+    'GLASS', 'BRASS', 'CHANNEL', 'FITTINGS', 'LUMINAIRES', 'PARTS',
+    'ONLY', 'ROAD', 'EXPRESS', 'GATEWAY', 'SOUTH', 'PLAINES',
+    'JUNO', 'WOLF', 'KALOS', 'KGGR', 'KGNT', '58PM', '36PM',
+    'ABL941020S81', '1C926', '1C22', 'NPP20', 'LSXR', 'J100',
+    'WRDC', 'ND98413', '2633371', '252829',
+    # Shipping/Document identifiers (not part numbers)
+    'NPD', 'MJCR', 'SCAC', 'BOL', 'AWB', 'PRO', 'PO', 'SO',
+    'ENTRY', 'SHIPMENT', 'TRACKING', 'CONTAINER', 'BOOKING',
+    # Measurement units (not part numbers)
+    'LM', 'LMN', 'LUMEN', 'MA', 'AMP', 'VOLT', 'WATT', 'KG', 'LBS',
+    # Document prefixes
+    'PD00', 'NPD00', 'EG0'
+])
+
+# All keywords as one alternation so a candidate is checked in a single regex scan
+_FALSE_POSITIVE_RE = re.compile('|'.join(
+    re.escape(keyword) for keyword in sorted(PART_NUMBER_FALSE_POSITIVES, key=len, reverse=True)
+))
+
+
 def parse_invoice_from_text(text):
     """Parse invoice data from unstructured text"""
     data = {}
     
-    # Enhanced invoice patterns for your specific format
-    patterns = {
-        'invoice_number': [
-            r'(\d{3,}[A-Z]-\d{8,})',  # Pattern like 074M-22005749
-            r'(\d{3,}[A-Z]\d{8,})',   # Pattern like 074M22005749
-            r'Invoice[:\s#]*([A-Z0-9-]+)',
-        ],
-        'invoice_date': [
-            r'(\d{1,2}[A-Za-z]{3}/\d{2}/\d{4})',  # Pattern like 21Oct/2025
-            r'Date[:\s]*([0-9/-]+)',
-        ],
-        'seller_name': [
-            r'([A-Za-z\s&.,]+(?:S\.\s*de\s*RL\s*de\s*CV|INC|CORP|LLC|LTD))',  # Company names
-            r'(?:Seller|From|Exporter)[:\s]*([^\n]+)',
-        ],
-        'buyer_name': [
-            r'(?:Buyer|To|Importer)[:\s]*([^\n]+)',
-        ],
-        'total_amount': [
-            r'Total[:\s]*\$?([0-9,]+\.?[0-9]*)',
-            r'\$([0-9,]+\.?[0-9]*)',  # Any dollar amount
-        ],
-        'currency': [
-            r'Currency[:\s]*([A-Z]{3})',
-            r'\b(USD|MXN|CAD)\b',  # Common currencies
-        ],
-        'country_origin': [
-            r'([A-Z]{2})\s+[A-Z]{3}\s+[A-Z]',  # Pattern like "MX NIO D"
-            r'(?:Country of Origin|Origin)[:\s]*([^\n]+)',
-        ],
-        'country_destination': [
-            r'(?:Country of Destination|Destination)[:\s]*([^\n]+)',
-        ],
-        'terms': [
-            r'(?:Terms|Payment Terms|INCOTERM)[:\s]*([^\n]+)',
-        ],
-    }
-    
-    for field, pattern_list in patterns.items():
+    for field, pattern_list in _INVOICE_PATTERNS.items():
         for pattern in pattern_list:
-            match = re.search(pattern, text, re.IGNORECASE)
+            match = pattern.search(text)
             if match:
                 data[field] = match.group(1).strip()
                 break
@@ -198,22 +596,8 @@ def extract_part_numbers_from_text(text, invoice_number=None):
         List of filtered part numbers
     """
     part_numbers = []
-    
-    # More specific part number patterns based on your actual data
-    patterns = [
-        r'\*([A-Z0-9]{6,7})\b',             # Pattern like *214N53, *183NK5
-        r'\b([A-Z]{2,}\d{4,})\b',           # Pattern like COMP001, MEM002
-        r'\b(\d{4,}[A-Z]{2,})\b',           # Pattern like 001COMP, 002MEM
-        r'\b([A-Z]{1,3}\d{3,6})\b',         # Pattern like A123, AB1234
-        r'\b(\d{3,6}[A-Z]{1,3})\b',         # Pattern like 123A, 1234AB
-        # More specific patterns for actual part numbers
-        r'\b([A-Z]{2,3}\d{3,4}[A-Z]{1,2})\b',  # Pattern like 214N53, 222A7C
-        r'\b(\d{3,4}[A-Z]{2,3}\d{1,2})\b',     # Pattern like 253G2M, 2575L7
-    ]
-    
-    for pattern in patterns:
-        matches = re.findall(pattern, text)
-        part_numbers.extend(matches)
+    for match in _PART_NUMBER_RE.finditer(text):
+        part_numbers.append(match.group('starred') or match.group('word'))
     
     # Build dynamic invoice number filter patterns
     invoice_patterns = []
@@ -223,51 +607,26 @@ def extract_part_numbers_from_text(text, invoice_number=None):
         # Remove dashes and add that variation
         invoice_patterns.append(invoice_number.replace('-', '').upper())
         # Extract just the numeric part if it has a pattern like 074M-22006670
-        numeric_match = re.search(r'(\d{8,})', invoice_number)
+        numeric_match = _INVOICE_NUMERIC_RE.search(invoice_number)
         if numeric_match:
             invoice_patterns.append(numeric_match.group(1))
         # Extract prefix part (like 074M)
-        prefix_match = re.search(r'^(\d{3,}[A-Z]+)', invoice_number)
+        prefix_match = _INVOICE_PREFIX_RE.search(invoice_number)
         if prefix_match:
             invoice_patterns.append(prefix_match.group(1))
     
     # Remove duplicates and filter out common false positives
     filtered_numbers = []
     for num in set(part_numbers):
-        # Skip if matches invoice number or its variations
-        if invoice_number and any(
-            inv_pattern in num.upper() or 
-            num.upper() in inv_pattern or
-            num.upper() == inv_pattern
+        num_upper = num.upper()
+        # Skip if matches invoice number or its variations (either contains the other)
+        if any(
+            inv_pattern in num_upper or num_upper in inv_pattern
             for inv_pattern in invoice_patterns
         ):
             continue
         # More comprehensive filtering (removed specific invoice numbers - now handled dynamically above)
-        if not any(false_positive in num.upper() for false_positive in 
-                  ['USD', 'FOB', 'NET', 'TOTAL', 'DATE', 'INVOICE', 'QUANTITY', 'MX', 'US', 
-                   'PAGE', 'ENTRY', 'PORT', 'VALUE', 'RATE', 'DUTY', 'PACKING', 'WEIGHT',
-                   'ORIGIN', 'DESTINATION', 'CURRENCY', 'TERMS', 'PAYMENT', 'FREIGHT',
-                   'CARRIER', 'TRUCK', 'CHARGE', 'INCOTERM', 'RECORD', 'IMPORTER',
-                   'SUMMARY', 'DESCRIPTION', 'CONTROLLERS', 'SENSOR', 'RELAY', 'FIXTURE',
-                   'LIGHTING', 'LIGHT', 'WALL', 'CEILING', 'MOTION', 'OCCUPATION',
-                   'PROGRAMMABLE', 'PALLETS', 'BUNDLES', 'PACK', 'UNIT', 'TYPE',
-                   'NUMBER', 'PART', 'GROSS', 'LOCAL', 'ESTIMATED', 'PKGS', 'DUTIABLE',
-                   'VENDOR', 'BRANDS', 'ACUITY', 'CALIFORNIA', 'TEXAS', 'GEORGIA',
-                   'ATLANTA', 'LAREDO', 'GUADALUPE', 'LEON', 'NUEVO', 'ENLACE',
-                   'PARQUE', 'PLANTA', 'SILLA', 'LASILLA', 'ARQUE', 'AARQUE',
-                   'PEACHTREE', 'SUITE', 'STREET', 'BASE', 'METAL', 'PLASTIC',
-                   'GLASS', 'BRASS', 'CHANNEL', 'FITTINGS', 'LUMINAIRES', 'PARTS',
-                   'ONLY', 'ROAD', 'EXPRESS', 'GATEWAY', 'SOUTH', 'PLAINES',
-                   'JUNO', 'WOLF', 'KALOS', 'KGGR', 'KGNT', '58PM', '36PM',
-                   'ABL941020S81', '1C926', '1C22', 'NPP20', 'LSXR', 'J100',
-                   'WRDC', 'ND98413', '2633371', '252829',
-                   # Shipping/Document identifiers (not part numbers)
-                   'NPD', 'MJCR', 'SCAC', 'BOL', 'AWB', 'PRO', 'PO', 'SO',
-                   'ENTRY', 'SHIPMENT', 'TRACKING', 'CONTAINER', 'BOOKING',
-                   # Measurement units (not part numbers)
-                   'LM', 'LMN', 'LUMEN', 'MA', 'AMP', 'VOLT', 'WATT', 'KG', 'LBS',
-                   # Document prefixes
-                   'PD00', 'NPD00', 'EG0']):
+        if not _FALSE_POSITIVE_RE.search(num_upper):
             # Skip numbers that look like document/shipment/entry numbers
             # NPD00357349, 2624034386002641, etc. are too long to be part numbers
             if len(num) > 12:  # Part numbers typically < 12 characters
@@ -300,54 +659,87 @@ def combine_document_data(pdf_data, txt_data):
 def extract_part_numbers_from_txt_file(file_path):
     """Extract part numbers from TXT file's PART column"""
     try:
-        # Try to read as structured data first with different encodings
+        # Try to read as structured data first, decoding the file only once
         df = None
-        encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1', 'utf-16', 'utf-32']
+        content, encoding = read_text_file(file_path)
         
-        for encoding in encodings:
-            try:
-                df = pd.read_csv(file_path, sep='\t', index_col=False, encoding=encoding)
-                print(f"Successfully read TXT file for part numbers with {encoding} encoding")
-                break
-            except Exception as e:
-                print(f"Failed to read TXT file with {encoding}: {e}")
-                continue
+        try:
+            df = pd.read_csv(io.StringIO(content), sep='\t', index_col=False)
+            logger.debug("Successfully read TXT file for part numbers with %s encoding", encoding)
+        except Exception as e:
+            logger.warning("Failed to read TXT file as tab-delimited data: %s", e)
         
         if df is not None and 'PART' in df.columns:
             part_numbers = df['PART'].dropna().astype(str).tolist()
             # Filter out empty strings and clean up
             part_numbers = [p.strip() for p in part_numbers if p.strip() and p.strip() != 'nan']
-            print(f"Extracted {len(part_numbers)} part numbers from TXT file")
+            logger.info("Extracted %s part numbers from TXT file", len(part_numbers))
             return part_numbers
         else:
-            print("No PART column found in TXT file")
+            logger.info("No PART column found in TXT file")
     except Exception as e:
-        print(f"Error reading TXT file for part numbers: {e}")
+        logger.warning("Error reading TXT file for part numbers: %s", e)
     
     # If structured parsing fails, try to extract from unstructured text
     try:
         content = extract_text_from_txt(file_path)
         part_numbers = extract_part_numbers_from_text(content)
-        print(f"Extracted {len(part_numbers)} part numbers from unstructured text")
+        logger.info("Extracted %s part numbers from unstructured text", len(part_numbers))
         return part_numbers
     except Exception as e:
-        print(f"Error extracting part numbers from text: {e}")
+        logger.warning("Error extracting part numbers from text: %s", e)
         return []
 
+# Deletion table for stripping asterisks when normalizing part numbers for matching
+_DEL_STAR = str.maketrans('', '', '*')
+
+
+def _part_number_matrix(part_sets, vocabulary):
+    """Build a 0/1 matrix with one row per part-number set and one column per vocabulary entry"""
+    matrix = np.zeros((len(part_sets), len(vocabulary)), dtype=np.float32)
+    for row, parts in enumerate(part_sets):
+        matrix[row, [vocabulary[p] for p in parts]] = 1.0
+    return matrix
+
+
 def match_files_by_part_numbers(pdf_files, txt_files):
     """Match PDF and TXT files based on part numbers found in content"""
     matches = []
     
-    for pdf_file in pdf_files:
-        # Extract text from PDF
-        pdf_text = extract_text_from_pdf(pdf_file['filepath'])
-        
-        # Parse invoice data to get invoice number for filtering
-        parsed_data = parse_invoice_from_text(pdf_text)
-        invoice_number = parsed_data.get('invoice_number')
-        
-        # Extract part numbers from PDF, excluding invoice number
-        pdf_part_numbers = extract_part_numbers_from_text(pdf_text, invoice_number=invoice_number)
+    # Each TXT file is read and normalized at most once, however many PDFs are matched
+    txt_parts_cache = {}
+    
+    def get_txt_parts(txt_file):
+        filepath = txt_file['filepath']
+        if filepath not in txt_parts_cache:
+            part_numbers = extract_part_numbers_from_txt_file(filepath)
+            normalized = frozenset(p.translate(_DEL_STAR).upper() for p in part_numbers)
+            txt_parts_cache[filepath] = (part_numbers, normalized)
+        return txt_parts_cache[filepath]
+    
+    # Parsing each PDF gets the invoice number and the part numbers with it excluded
+    pdf_part_lists = [
+        parse_invoice_from_text(extract_text_from_pdf(pdf_file['filepath']))['part_numbers']
+        for pdf_file in pdf_files
+    ]
+    
+    # Score every PDF against every TXT file at once: with each file as a 0/1 vector
+    # over all part numbers, the matrix product counts the shared part numbers
+    scores = None
+    if txt_files and any(pdf_part_lists):
+        # Normalize part numbers for comparison (remove asterisks and convert to uppercase)
+        pdf_normalized = [frozenset(p.translate(_DEL_STAR).upper() for p in parts) for parts in pdf_part_lists]
+        txt_normalized = [get_txt_parts(txt_file)[1] for txt_file in txt_files]
+        
+        vocabulary = {}
+        for parts in pdf_normalized + txt_normalized:
+            for part in parts:
+                vocabulary.setdefault(part, len(vocabulary))
+        
+        scores = _part_number_matrix(pdf_normalized, vocabulary) @ _part_number_matrix(txt_normalized, vocabulary).T
+    
+    for pdf_index, pdf_file in enumerate(pdf_files):
+        pdf_part_numbers = pdf_part_lists[pdf_index]
         
         best_match = None
         max_matches = 0
@@ -359,34 +751,72 @@ def match_files_by_part_numbers(pdf_files, txt_files):
                 best_match = txt_files[0]  # Take the first TXT file as default
                 max_matches = 1  # Indicate it's a fallback match
         
-        # Try to match based on part numbers if PDF has text
-        if not best_match:
-            for txt_file in txt_files:
-                # Extract part numbers from TXT file
-                txt_part_numbers = extract_part_numbers_from_txt_file(txt_file['filepath'])
-                
-                # Normalize part numbers for comparison (remove asterisks and convert to uppercase)
-                pdf_normalized = {p.replace('*', '').upper() for p in pdf_part_numbers}
-                txt_normalized = {p.replace('*', '').upper() for p in txt_part_numbers}
-                
-                # Count matching part numbers
-                matches_count = len(pdf_normalized & txt_normalized)
-                
-                if matches_count > max_matches:
-                    max_matches = matches_count
-                    best_match = txt_file
+        # Otherwise pick the first TXT file sharing the most part numbers
+        elif scores is not None:
+            txt_index = int(scores[pdf_index].argmax())
+            if scores[pdf_index, txt_index] > 0:
+                max_matches = int(scores[pdf_index, txt_index])
+                best_match = txt_files[txt_index]
         
         matches.append({
             'pdf': pdf_file,
             'txt': best_match,
             'match_score': max_matches,
             'pdf_parts': pdf_part_numbers,
-            'txt_parts': extract_part_numbers_from_txt_file(best_match['filepath']) if best_match else [],
+            'txt_parts': get_txt_parts(best_match)[0] if best_match else [],
             'pdf_has_text': len(pdf_part_numbers) > 0
         })
     
     return matches
 
+# Source columns used to build line items, with the value used when a column is absent
+LINE_ITEM_COLUMN_DEFAULTS = {
+    'PART': '',
+    'PART_DESC': '',
+    'HTTS': '',
+    'C/N': '',
+    'quantity': 0,
+    'AMT': 0,
+    'WEIGHT': 0,
+}
+
+
+def build_line_items(source_df):
+    """
+    Build output line items from tab-delimited/CSV invoice data using column-wise operations
+    
+    Args:
+        source_df: DataFrame with PART, PART_DESC, HTTS, C/N, quantity, AMT and WEIGHT columns
+        
+    Returns:
+        DataFrame in the output line item layout
+    """
+    # Missing numbers become 0; non-numeric values still raise like float() did,
+    # and map(str) keeps str()'s 'nan' for missing text where astype(str) would not
+    qty = pd.to_numeric(source_df['quantity']).fillna(0.0).to_numpy(dtype=float)
+    unit_price = pd.to_numeric(source_df['AMT']).fillna(0.0).to_numpy(dtype=float)
+    weight = pd.to_numeric(source_df['WEIGHT']).fillna(0.0).to_numpy(dtype=float)
+    
+    def text_column(col):
+        return source_df[col].map(str).str.strip().to_numpy()
+    
+    # Columns go in as already-typed arrays on a fresh index, so pandas neither
+    # aligns on the (possibly filtered) source index nor re-infers column types
+    return pd.DataFrame({
+        'SKU': text_column('PART'),
+        'DESCRIPTION': text_column('PART_DESC'),
+        'HTS': text_column('HTTS'),
+        'COUNTRY OF ORIGIN': text_column('C/N'),
+        'NO. OF PACKAGE': '',
+        'QUANTITY': qty,
+        'NET WEIGHT': weight,
+        'GROSS WEIGHT': weight,
+        'UNIT PRICE': unit_price,
+        'VALUE': qty * unit_price,
+        'QTY UNIT': 'EA'
+    }, index=pd.RangeIndex(len(source_df)))
+
+
 def process_invoice_data(file_path, file_type, invoice_number=None):
     """
     Process invoice data from various file types
@@ -409,9 +839,9 @@ def process_invoice_data(file_path, file_type, invoice_number=None):
         parsed_data = parse_invoice_from_text(text)
         
         # Log extracted invoice metadata for debugging
-        print(f"PDF Invoice Number: {parsed_data.get('invoice_number', 'N/A')}")
-        print(f"PDF Seller: {parsed_data.get('seller_name', 'Unknown')}")
-        print(f"PDF Country: {parsed_data.get('country_origin', 'N/A')}")
+        logger.info("PDF Invoice Number: %s", parsed_data.get('invoice_number', 'N/A'))
+        logger.info("PDF Seller: %s", parsed_data.get('seller_name', 'Unknown'))
+        logger.info("PDF Country: %s", parsed_data.get('country_origin', 'N/A'))
         
         # Return empty DataFrame - do NOT create a line item from invoice metadata
         # The paired TXT file will provide the actual line items
@@ -423,47 +853,16 @@ def process_invoice_data(file_path, file_type, invoice_number=None):
     elif file_type == 'txt':
         # Check if it's structured tab-delimited data or unstructured text
         try:
-            # Try to read as tab-delimited first with different encodings
-            txt_df = None
-            encodings = ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1', 'utf-16', 'utf-32']
-            
-            for encoding in encodings:
-                try:
-                    txt_df = pd.read_csv(file_path, sep='\t', index_col=False, encoding=encoding)
-                    print(f"Successfully read TXT file for processing with {encoding} encoding")
-                    break
-                except Exception as e:
-                    print(f"Failed to read TXT file with {encoding}: {e}")
-                    continue
-            
-            if txt_df is None:
-                raise Exception("Could not read file with any encoding")
+            # Try to read as tab-delimited first, decoding the file only once
+            content, encoding = read_text_file(file_path)
+            txt_df = pd.read_csv(io.StringIO(content), sep='\t', index_col=False)
+            logger.debug("Successfully read TXT file for processing with %s encoding", encoding)
             
             # If successful, process as structured data
             if invoice_number:
                 txt_df = txt_df[txt_df['invoice_nbr'] == invoice_number]
             
-            output_data = []
-            for idx, row in txt_df.iterrows():
-                qty = float(row['quantity']) if pd.notna(row['quantity']) else 0.0
-                unit_price = float(row['AMT']) if pd.notna(row['AMT']) else 0.0
-                weight = float(row['WEIGHT']) if pd.notna(row['WEIGHT']) else 0.0
-                
-                output_data.append({
-                    'SKU': str(row['PART']).strip(),
-                    'DESCRIPTION': str(row['PART_DESC']).strip(),
-                    'HTS': str(row['HTTS']).strip(),
-                    'COUNTRY OF ORIGIN': str(row['C/N']).strip(),
-                    'NO. OF PACKAGE': '',
-                    'QUANTITY': qty,
-                    'NET WEIGHT': weight,
-                    'GROSS WEIGHT': weight,
-                    'UNIT PRICE': unit_price,
-                    'VALUE': qty * unit_price,
-                    'QTY UNIT': 'EA'
-                })
-            
-            return pd.DataFrame(output_data)
+            return build_line_items(txt_df)
             
         except Exception:
             # If tab-delimited parsing fails, treat as unstructured text
@@ -493,32 +892,42 @@ def process_invoice_data(file_path, file_type, invoice_number=None):
         if invoice_number:
             csv_df = csv_df[csv_df['invoice_nbr'] == invoice_number]
         
-        output_data = []
-        for idx, row in csv_df.iterrows():
-            qty = float(row.get('quantity', 0)) if pd.notna(row.get('quantity', 0)) else 0.0
-            unit_price = float(row.get('AMT', 0)) if pd.notna(row.get('AMT', 0)) else 0.0
-            weight = float(row.get('WEIGHT', 0)) if pd.notna(row.get('WEIGHT', 0)) else 0.0
-            
-            output_data.append({
-                'SKU': str(row.get('PART', '')).strip(),
-                'DESCRIPTION': str(row.get('PART_DESC', '')).strip(),
-                'HTS': str(row.get('HTTS', '')).strip(),
-                'COUNTRY OF ORIGIN': str(row.get('C/N', '')).strip(),
-                'NO. OF PACKAGE': '',
-                'QUANTITY': qty,
-                'NET WEIGHT': weight,
-                'GROSS WEIGHT': weight,
-                'UNIT PRICE': unit_price,
-                'VALUE': qty * unit_price,
-                'QTY UNIT': 'EA'
-            })
-        
-        return pd.DataFrame(output_data)
+        # CSV exports may omit columns; fill them with the same defaults as before
+        missing_columns = {
+            column: default for column, default in LINE_ITEM_COLUMN_DEFAULTS.items()
+            if column not in csv_df.columns
+        }
+        return build_line_items(csv_df.assign(**missing_columns))
     
     else:
         raise ValueError(f"Unsupported file type: {file_type}")
 
 
+def process_file_pair(pair, invoice_number=None):
+    """
+    Process the PDF file of a pair and its TXT file, if any
+    
+    Args:
+        pair: Dict with 'pdf' and optional 'txt' file info
+        invoice_number: Specific invoice number to filter (optional)
+        
+    Returns:
+        Tuple of (pdf_df, txt_df) line item DataFrames, with txt_df None if there is no TXT file
+    """
+    pdf_file = pair['pdf']
+    txt_file = pair.get('txt')
+    
+    # Process PDF file
+    pdf_df = process_invoice_data(pdf_file['filepath'], pdf_file['type'], invoice_number)
+    
+    # Process TXT file if provided
+    txt_df = None
+    if txt_file:
+        txt_df = process_invoice_data(txt_file['filepath'], txt_file['type'], invoice_number)
+    
+    return pdf_df, txt_df
+
+
 def format_dataframe_for_csv(df):
     """
     Format DataFrame to ensure numeric columns are properly typed and formatted
@@ -530,7 +939,9 @@ def format_dataframe_for_csv(df):
     Returns:
         Formatted DataFrame with proper numeric types
     """
-    df_formatted = df.copy()
+    # A shallow copy is enough: columns are only ever replaced, never modified in place,
+    # so the caller's DataFrame is left untouched without duplicating its data
+    df_formatted = df.copy(deep=False)
     
     # Define numeric columns that should be properly formatted
     numeric_columns = ['QUANTITY', 'NET WEIGHT', 'GROSS WEIGHT', 'UNIT PRICE', 'VALUE']
@@ -580,6 +991,23 @@ def format_number_for_csv(value):
     return formatted if formatted else '0'
 
 
+def format_numbers_for_csv(series):
+    """
+    Vectorized form of format_number_for_csv for a whole numeric column.
+    
+    Args:
+        series: Float Series to format
+        
+    Returns:
+        Series of strings without trailing zeros or scientific notation
+    """
+    values = series.to_numpy(dtype=float)
+    formatted = pd.Series(np.char.mod('%.10f', values), index=series.index, dtype=object)
+    formatted = formatted.str.rstrip('0').str.rstrip('.')
+    formatted[(values == 0) | np.isnan(values)] = '0'
+    return formatted
+
+
 def write_csv_with_proper_formatting(df, output_path):
     """
     Write DataFrame to CSV with proper number formatting to avoid scientific notation.
@@ -616,16 +1044,30 @@ def write_csv_with_proper_formatting(df, output_path):
     df_formatted = df_formatted[existing_columns + remaining_columns]
     
     # Format numeric columns to remove trailing zeros while keeping them as numbers
+    # (column selection above already produced a new frame, so no extra copy is needed)
     numeric_cols = ['QUANTITY', 'NET WEIGHT', 'GROSS WEIGHT', 'UNIT PRICE', 'VALUE']
-    df_to_write = df_formatted.copy()
     
     for col in numeric_cols:
-        if col in df_to_write.columns:
+        if col in df_formatted.columns:
             # Apply formatting to remove trailing zeros
-            df_to_write[col] = df_to_write[col].apply(format_number_for_csv)
+            df_formatted[col] = format_numbers_for_csv(df_formatted[col])
     
     # Write CSV - numbers will be written as plain decimals without scientific notation
-    df_to_write.to_csv(output_path, index=False)
+    df_formatted.to_csv(output_path, index=False)
+
+
+def write_csvs_with_proper_formatting(outputs):
+    """
+    Write several DataFrames with write_csv_with_proper_formatting, one thread each,
+    so the file writes (which release the GIL) overlap
+    
+    Args:
+        outputs: List of (df, output_path) pairs
+    """
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        futures = [executor.submit(write_csv_with_proper_formatting, df, path) for df, path in outputs]
+        for future in futures:
+            future.result()
 
 
 def aggregate_by_sku(df):
@@ -676,8 +1118,11 @@ def aggregate_by_sku(df):
     
     # Recalculate unit price based on aggregated values
     # Unit price = total value / total quantity
-    mask = aggregated['QUANTITY'] > 0
-    aggregated.loc[mask, 'UNIT PRICE'] = aggregated.loc[mask, 'VALUE'] / aggregated.loc[mask, 'QUANTITY']
+    # (only where quantity is positive; other rows keep the averaged unit price)
+    quantity = aggregated['QUANTITY'].to_numpy(dtype=float)
+    unit_price = aggregated['UNIT PRICE'].to_numpy(dtype=float, copy=True)
+    np.divide(aggregated['VALUE'].to_numpy(dtype=float), quantity, out=unit_price, where=quantity > 0)
+    aggregated['UNIT PRICE'] = unit_price
     
     # Reorder columns to match the correct order (only include columns that exist)
     existing_columns = [col for col in correct_column_order if col in aggregated.columns]
@@ -700,22 +1145,26 @@ def generate_summary(df, invoice_number, include_aggregated=False):
     Returns:
         Dictionary with summary statistics
     """
+    # Convert each numeric column once; the totals and breakdowns below all reuse it
+    numeric = {
+        col: pd.to_numeric(df[col], errors='coerce').fillna(0.0)
+        for col in ['QUANTITY', 'NET WEIGHT', 'GROSS WEIGHT', 'VALUE']
+        if col in df.columns
+    }
+    
+    def total(col):
+        return float(numeric[col].sum()) if col in numeric else 0.0
+    
     # Helper function to safely get top HTS codes
     def get_top_hts_codes(df):
         if 'HTS' not in df.columns or 'VALUE' not in df.columns:
             return {}
         try:
-            # Ensure VALUE is numeric
-            df_copy = df.copy()
-            df_copy['VALUE'] = pd.to_numeric(df_copy['VALUE'], errors='coerce').fillna(0.0)
             # Group by HTS and sum values, then get top 5
-            grouped = df_copy.groupby('HTS')['VALUE'].sum()
-            # Ensure the result is numeric before using nlargest
-            if grouped.dtype == 'object':
-                grouped = pd.to_numeric(grouped, errors='coerce').fillna(0.0)
+            grouped = numeric['VALUE'].groupby(df['HTS']).sum()
             return grouped.nlargest(5).to_dict()
         except Exception as e:
-            print(f"Error getting top HTS codes: {e}")
+            logger.warning("Error getting top HTS codes: %s", e)
             return {}
     
     # Helper function to safely get quantity by SKU
@@ -723,26 +1172,20 @@ def generate_summary(df, invoice_number, include_aggregated=False):
         if 'SKU' not in df.columns or 'QUANTITY' not in df.columns:
             return {}
         try:
-            # Ensure QUANTITY is numeric
-            df_copy = df.copy()
-            df_copy['QUANTITY'] = pd.to_numeric(df_copy['QUANTITY'], errors='coerce').fillna(0.0)
-            grouped = df_copy.groupby('SKU')['QUANTITY'].sum()
-            # Ensure the result is numeric
-            if grouped.dtype == 'object':
-                grouped = pd.to_numeric(grouped, errors='coerce').fillna(0.0)
+            grouped = numeric['QUANTITY'].groupby(df['SKU']).sum()
             return grouped.to_dict()
         except Exception as e:
-            print(f"Error getting quantity by SKU: {e}")
+            logger.warning("Error getting quantity by SKU: %s", e)
             return {}
     
     summary = {
         'invoice_number': invoice_number,
         'timestamp': datetime.now().isoformat(),
         'total_lines': len(df),
-        'total_quantity': float(pd.to_numeric(df['QUANTITY'], errors='coerce').fillna(0.0).sum()) if 'QUANTITY' in df.columns else 0.0,
-        'total_net_weight': float(pd.to_numeric(df['NET WEIGHT'], errors='coerce').fillna(0.0).sum()) if 'NET WEIGHT' in df.columns else 0.0,
-        'total_gross_weight': float(pd.to_numeric(df['GROSS WEIGHT'], errors='coerce').fillna(0.0).sum()) if 'GROSS WEIGHT' in df.columns else 0.0,
-        'total_value': float(pd.to_numeric(df['VALUE'], errors='coerce').fillna(0.0).sum()) if 'VALUE' in df.columns else 0.0,
+        'total_quantity': total('QUANTITY'),
+        'total_net_weight': total('NET WEIGHT'),
+        'total_gross_weight': total('GROSS WEIGHT'),
+        'total_value': total('VALUE'),
         'unique_hts_codes': int(df['HTS'].nunique()) if 'HTS' in df.columns else 0,
         'unique_skus': int(df['SKU'].nunique()) if 'SKU' in df.columns else 0,
         'countries': df['COUNTRY OF ORIGIN'].value_counts().to_dict() if 'COUNTRY OF ORIGIN' in df.columns else {},
@@ -762,6 +1205,12 @@ def generate_summary(df, invoice_number, include_aggregated=False):
     return summary
 
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    """Reject oversize uploads (over MAX_CONTENT_LENGTH) with a JSON error"""
+    return jsonify({'error': 'File exceeds the maximum upload size'}), 413
+
+
 @app.route('/')
 def index():
     """Serve the enhanced main page"""
@@ -788,8 +1237,16 @@ def manual_cleanup():
         days = request.json.get('days', 7) if request.is_json else 7
         
         uploads_removed, uploads_size = cleanup_old_files(UPLOAD_FOLDER, days_old=days)
+        cache_removed, cache_size = cleanup_old_files(PDF_TEXT_CACHE_FOLDER, days_old=days)
+        uploads_removed += cache_removed
+        uploads_size += cache_size
         outputs_removed, outputs_size = cleanup_old_files(OUTPUT_FOLDER, days_old=days)
         
+        # Drop in-memory entries for files that may have just been removed
+        _file_digest_cached.cache_clear()
+        with _PDF_TEXT_MEMO_LOCK:
+            _pdf_text_memo.clear()
+        
         total_files = uploads_removed + outputs_removed
         total_size = uploads_size + outputs_size
         total_mb = total_size / (1024 * 1024)
@@ -803,6 +1260,8 @@ def manual_cleanup():
             'message': f'Cleaned up {total_files} files ({total_mb:.2f} MB)'
         })
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -819,14 +1278,17 @@ def upload_multiple_files():
             return jsonify({'error': 'No files selected'}), 400
         
         uploaded_files = []
+        files_to_save = {}
+        timestamp = time.strftime('%Y%m%d_%H%M%S')
+        upload_dir = app.config['UPLOAD_FOLDER']
         for file in files:
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
                 file_type = filename.rsplit('.', 1)[1].lower()
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
                 saved_filename = f"{timestamp}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], saved_filename)
-                file.save(filepath)
+                filepath = os.path.join(upload_dir, saved_filename)
+                # Same-named files share a path; as with sequential saves, the last one wins
+                files_to_save[filepath] = file
                 
                 uploaded_files.append({
                     'filename': filename,
@@ -835,11 +1297,65 @@ def upload_multiple_files():
                     'type': file_type
                 })
         
+        # Disk writes are I/O bound, so save the files concurrently
+        if files_to_save:
+            with ThreadPoolExecutor(max_workers=min(8, len(files_to_save))) as executor:
+                list(executor.map(save_upload, files_to_save.values(), files_to_save.keys()))
+        
         return jsonify({
             'message': f'Successfully uploaded {len(uploaded_files)} files',
             'files': uploaded_files
         })
         
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload-file/<filename>', methods=['PUT'])
+def upload_raw_file(filename):
+    """
+    Handle a single raw file upload (request body is the file content)
+    
+    The body is streamed straight to disk, skipping multipart form parsing,
+    which makes this the cheaper route for large PDFs.
+    """
+    try:
+        filename = secure_filename(filename)
+        if not allowed_file(filename):
+            return jsonify({'error': 'Invalid file type. Please upload .txt, .csv, or .pdf'}), 400
+        
+        file_type = filename.rsplit('.', 1)[1].lower()
+        timestamp = time.strftime('%Y%m%d_%H%M%S')
+        saved_filename = f"{timestamp}_{filename}"
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], saved_filename)
+        
+        try:
+            with open(filepath, 'wb') as fp:
+                shutil.copyfileobj(request.stream, fp, length=UPLOAD_CHUNK_SIZE)
+                size = fp.tell()
+        except Exception:
+            # Don't leave a partial upload behind
+            with suppress(FileNotFoundError):
+                os.remove(filepath)
+            raise
+        
+        if size == 0:
+            os.remove(filepath)
+            return jsonify({'error': 'No file content provided'}), 400
+        
+        return jsonify({
+            'message': 'Successfully uploaded 1 files',
+            'files': [{
+                'filename': filename,
+                'saved_filename': saved_filename,
+                'filepath': filepath,
+                'type': file_type
+            }]
+        })
+        
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -861,6 +1377,8 @@ def match_files_by_parts():
             'message': f'Found {len([m for m in matches if m["txt"]])} file matches based on part numbers'
         })
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -884,35 +1402,37 @@ def process_combined_files():
             'processing_timestamp': datetime.now().isoformat()
         }
         
-        for pair in file_pairs:
-            pdf_file = pair.get('pdf')
+        if not all(pair.get('pdf') for pair in file_pairs):
+            return jsonify({'error': 'PDF file is required for each pair'}), 400
+        
+        # Pairs whose PDF text is already cached take milliseconds, so only the others,
+        # which may need OCR, are worth spreading over threads (tesseract runs in
+        # subprocesses, so a waiting thread doesn't hold the GIL)
+        uncached = [
+            i for i, pair in enumerate(file_pairs)
+            if not is_pdf_text_cached(pair['pdf']['filepath'])
+        ]
+        pair_results = [None] * len(file_pairs)
+        if OCR_WORKERS > 1 and len(uncached) > 1:
+            with ThreadPoolExecutor(max_workers=min(OCR_WORKERS, len(uncached))) as executor:
+                results = executor.map(
+                    process_file_pair, [file_pairs[i] for i in uncached], [invoice_number] * len(uncached)
+                )
+                for i, result in zip(uncached, results):
+                    pair_results[i] = result
+        for i, pair in enumerate(file_pairs):
+            if pair_results[i] is None:
+                pair_results[i] = process_file_pair(pair, invoice_number)
+        
+        for pair, (pdf_df, txt_df) in zip(file_pairs, pair_results):
+            pdf_file = pair['pdf']
             txt_file = pair.get('txt')
             
-            if not pdf_file:
-                return jsonify({'error': 'PDF file is required for each pair'}), 400
-            
-            # Process PDF file
-            pdf_df = process_invoice_data(pdf_file['filepath'], pdf_file['type'], invoice_number)
-            
-            # Process TXT file if provided
-            txt_df = pd.DataFrame()
-            if txt_file:
-                txt_df = process_invoice_data(txt_file['filepath'], txt_file['type'], invoice_number)
+            # Keep TXT data as additional rows; all frames are concatenated once after the loop
+            pair_frames = [df for df in (pdf_df, txt_df) if df is not None and not df.empty]
             
-            # Combine data from both files
-            if not txt_df.empty:
-                # Merge DataFrames, preferring TXT data where available
-                combined_df = pdf_df.copy()
-                for idx, row in txt_df.iterrows():
-                    # Add TXT data as additional rows or update existing
-                    combined_df = pd.concat([combined_df, row.to_frame().T], ignore_index=True)
-            else:
-                combined_df = pdf_df
-            
-            if not combined_df.empty:
-                all_results.append(combined_df)
-                combined_summary['total_line_items'] += len(combined_df)
-                combined_summary['total_value'] += combined_df['VALUE'].sum()
+            if pair_frames:
+                all_results.extend(pair_frames)
                 
                 # Track file types
                 file_type = f"{pdf_file['type']}"
@@ -926,6 +1446,8 @@ def process_combined_files():
         # Combine all results into single DataFrame
         final_df = pd.concat(all_results, ignore_index=True)
         combined_summary['total_files_processed'] = len(file_pairs)
+        combined_summary['total_line_items'] = len(final_df)
+        combined_summary['total_value'] = float(final_df['VALUE'].sum())
         combined_summary['total_quantity'] = float(final_df['QUANTITY'].sum()) if 'QUANTITY' in final_df.columns else 0.0
         
         # Generate aggregated data
@@ -939,27 +1461,28 @@ def process_combined_files():
                     text = extract_text_from_pdf(first_pdf['filepath'])
                     parsed_data = parse_invoice_from_text(text)
                     invoice_number = parsed_data.get('invoice_number', None)
-                    print(f"Extracted invoice number from PDF: {invoice_number}")
+                    logger.info("Extracted invoice number from PDF: %s", invoice_number)
             except Exception as e:
-                print(f"Could not extract invoice number from PDF: {e}")
+                logger.warning("Could not extract invoice number from PDF: %s", e)
         
         # Generate summary with aggregated data
         summary = generate_summary(final_df, invoice_number or 'ALL', include_aggregated=True)
         combined_summary.update(summary)
         
         # Generate final output CSV with proper number formatting (save raw data)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        timestamp = time.strftime('%Y%m%d_%H%M%S')
         # Include invoice number in filename for easy identification
-        safe_invoice = (invoice_number or 'ALL').replace('/', '-').replace('\\', '-').replace(' ', '_')
+        safe_invoice = (invoice_number or 'ALL').translate(_SAFE_INVOICE_TRANS)
+        output_dir = app.config['OUTPUT_FOLDER']
         output_filename = f"{timestamp}_{safe_invoice}_combined_processed.csv"
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-        # Use custom formatting function to ensure numbers are written as plain decimals
-        write_csv_with_proper_formatting(final_df, output_path)
+        output_path = os.path.join(output_dir, output_filename)
         
         # Also save aggregated CSV
         aggregated_filename = f"{timestamp}_{safe_invoice}_combined_aggregated.csv"
-        aggregated_path = os.path.join(app.config['OUTPUT_FOLDER'], aggregated_filename)
-        write_csv_with_proper_formatting(aggregated_df, aggregated_path)
+        aggregated_path = os.path.join(output_dir, aggregated_filename)
+        
+        # Use custom formatting function to ensure numbers are written as plain decimals
+        write_csvs_with_proper_formatting([(final_df, output_path), (aggregated_df, aggregated_path)])
         
         # Convert DataFrames to dict for JSON response (sample of data for display)
         raw_data_sample = final_df.head(100).to_dict('records') if len(final_df) > 0 else []
@@ -981,6 +1504,8 @@ def process_combined_files():
             'message': f'Successfully processed {len(file_pairs)} file pairs with {len(final_df)} total line items ({len(aggregated_df)} unique SKUs)'
         })
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1009,10 +1534,10 @@ def process_invoice():
         # Save uploaded file
         filename = secure_filename(data_file.filename)
         file_type = filename.rsplit('.', 1)[1].lower()
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        timestamp = time.strftime('%Y%m%d_%H%M%S')
         saved_filename = f"{timestamp}_{filename}"
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], saved_filename)
-        data_file.save(filepath)
+        save_upload(data_file, filepath)
         
         # Process the data
         result_df = process_invoice_data(filepath, file_type, invoice_number)
@@ -1027,9 +1552,9 @@ def process_invoice():
                     text = extract_text_from_pdf(filepath)
                     parsed_data = parse_invoice_from_text(text)
                     invoice_number = parsed_data.get('invoice_number', None)
-                    print(f"Extracted invoice number from file: {invoice_number}")
+                    logger.info("Extracted invoice number from file: %s", invoice_number)
             except Exception as e:
-                print(f"Could not extract invoice number: {e}")
+                logger.warning("Could not extract invoice number: %s", e)
         
         # Generate aggregated data
         aggregated_df = aggregate_by_sku(result_df)
@@ -1039,16 +1564,17 @@ def process_invoice():
         
         # Save output CSV with proper number formatting (save raw data)
         # Include invoice number in filename for easy identification
-        safe_invoice = (invoice_number or 'ALL').replace('/', '-').replace('\\', '-').replace(' ', '_')
+        safe_invoice = (invoice_number or 'ALL').translate(_SAFE_INVOICE_TRANS)
+        output_dir = app.config['OUTPUT_FOLDER']
         output_filename = f"{timestamp}_{safe_invoice}_processed.csv"
-        output_path = os.path.join(app.config['OUTPUT_FOLDER'], output_filename)
-        # Use custom formatting function to ensure numbers are written as plain decimals
-        write_csv_with_proper_formatting(result_df, output_path)
+        output_path = os.path.join(output_dir, output_filename)
         
         # Also save aggregated CSV
         aggregated_filename = f"{timestamp}_{safe_invoice}_aggregated.csv"
-        aggregated_path = os.path.join(app.config['OUTPUT_FOLDER'], aggregated_filename)
-        write_csv_with_proper_formatting(aggregated_df, aggregated_path)
+        aggregated_path = os.path.join(output_dir, aggregated_filename)
+        
+        # Use custom formatting function to ensure numbers are written as plain decimals
+        write_csvs_with_proper_formatting([(result_df, output_path), (aggregated_df, aggregated_path)])
         
         # Convert DataFrames to dict for JSON response (sample of data for display)
         raw_data_sample = result_df.head(100).to_dict('records') if len(result_df) > 0 else []
@@ -1071,6 +1597,8 @@ def process_invoice():
             'message': f'Successfully processed {len(result_df)} line items ({len(aggregated_df)} unique SKUs)'
         })
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1087,7 +1615,9 @@ def download_file(filename):
             filepath,
             mimetype='text/csv',
             as_attachment=True,
-            download_name=filename
+            download_name=filename,
+            # CSVs can be regenerated under the same name, so clients must revalidate
+            max_age=0
         )
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1102,32 +1632,43 @@ def preview_data():
         
         data_file = request.files['data_file']
         
-        # Read and preview
-        df = pd.read_csv(data_file, sep='\t', nrows=10)
+        # Read only the preview rows, as plain strings (no type inference or NA detection)
+        df = pd.read_csv(data_file, sep='\t', nrows=5, engine='c', dtype=str, na_filter=False)
         
         preview = {
             'columns': list(df.columns),
             'row_count': len(df),
-            'sample_data': df.head(5).to_dict('records')
+            'sample_data': df.to_dict('records')
         }
         
         return jsonify(preview)
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
     # Clean up old files on startup (remove files older than 7 days)
     print("\n" + "=" * 60)
     print("Invoice Processor - Starting up")
     print("=" * 60)
-    uploads_removed, uploads_size = cleanup_old_files(UPLOAD_FOLDER, days_old=7)
-    outputs_removed, outputs_size = cleanup_old_files(OUTPUT_FOLDER, days_old=7)
-    
-    if uploads_removed > 0 or outputs_removed > 0:
-        total_mb = (uploads_size + outputs_size) / (1024 * 1024)
-        print(f"Cleaned up {uploads_removed + outputs_removed} old files ({total_mb:.2f} MB)")
+    if cleanup_ran_recently():
+        print("Skipping cleanup, it already ran within the last hour")
+    else:
+        uploads_removed, uploads_size = cleanup_old_files(UPLOAD_FOLDER, days_old=7)
+        cache_removed, cache_size = cleanup_old_files(PDF_TEXT_CACHE_FOLDER, days_old=7)
+        uploads_removed += cache_removed
+        uploads_size += cache_size
+        outputs_removed, outputs_size = cleanup_old_files(OUTPUT_FOLDER, days_old=7)
+        mark_cleanup_done()
+        
+        if uploads_removed > 0 or outputs_removed > 0:
+            total_mb = (uploads_size + outputs_size) / (1024 * 1024)
+            print(f"Cleaned up {uploads_removed + outputs_removed} old files ({total_mb:.2f} MB)")
     
     print("=" * 60 + "\n")
     
@@ -10,7 +10,7 @@ print("=" * 60 + "\n")
 print(f"✓ Python: {sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}")
 
 # Test imports
-modules = ['flask', 'pandas', 'PyPDF2', 'pytesseract', 'pdf2image', 'PIL.Image']
+modules = ['flask', 'pandas', 'pypdfium2', 'pytesseract', 'PIL.Image']
 for m in modules:
     try:
         __import__(m)
@@ -6,7 +6,6 @@ Removes files older than specified days (default: 7 days).
 
 import os
 import time
-from pathlib import Path
 
 def cleanup_directory(directory, days_old=7):
     """
@@ -26,17 +25,17 @@ def cleanup_directory(directory, days_old=7):
     removed_count = 0
     total_size_removed = 0
     
-    for file_path in Path(directory).glob('*'):
-        if file_path.is_file():
-            file_stat = file_path.stat()
-            
-            # Check if file is older than cutoff
-            if file_stat.st_mtime < cutoff_time:
-                file_size = file_stat.st_size
-                os.remove(file_path)
-                removed_count += 1
-                total_size_removed += file_size
-                print(f"Removed: {file_path.name} ({file_size / 1024:.2f} KB)")
+    # DirEntry caches the stat results, so each file costs one stat call
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                file_stat = entry.stat(follow_symlinks=False)
+                
+                # Check if file is older than cutoff
+                if file_stat.st_mtime < cutoff_time:
+                    os.remove(entry.path)
+                    removed_count += 1
+                    total_size_removed += file_stat.st_size
     
     total_mb = total_size_removed / (1024 * 1024)
     print(f"\nTotal removed from {directory}: {removed_count} files ({total_mb:.2f} MB)")
@@ -63,6 +62,14 @@ def main():
         print("Cleaning uploads/ directory:")
         uploads_count, uploads_size = cleanup_directory('uploads', days_old)
     
+    # Cached PDF text lives in a hidden folder under uploads/ and counts towards it
+    cache_folder = os.path.join('uploads', '.pdf_text_cache')
+    if os.path.exists(cache_folder):
+        print("\nCleaning uploads/.pdf_text_cache/ directory:")
+        cache_count, cache_size = cleanup_directory(cache_folder, days_old)
+        uploads_count += cache_count
+        uploads_size += cache_size
+    
     if os.path.exists('outputs'):
         print("\nCleaning outputs/ directory:")
         outputs_count, outputs_size = cleanup_directory('outputs', days_old)
@@ -1,20 +1,37 @@
 #!/usr/bin/env python3
-"""Simple startup script for Flask application"""
+"""
+Simple startup script for Flask application
+
+Runs the app under gunicorn with one sync worker process per core, so one
+request per core is handled at a time. Pass --debug (or set FLASK_DEBUG=1)
+to use the Flask development server with the debugger and reloader instead.
+"""
 
 import sys
 import os
 
 # Add current directory to path
-sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _HERE)
 
 # Start the Flask app
 if __name__ == '__main__':
-    from app import app
+    debug = '--debug' in sys.argv[1:] or os.environ.get('FLASK_DEBUG') == '1'
     print("=" * 60)
     print("Starting Invoice Processor on http://localhost:5001")
     print("=" * 60)
-    app.run(debug=True, host='0.0.0.0', port=5001)
-
-
-
 
+    if debug:
+        from app import app
+        app.run(debug=True, host='0.0.0.0', port=5001)
+    else:
+        # Replace this process with gunicorn so it receives signals directly
+        os.execv(sys.executable, [
+            sys.executable, '-m', 'gunicorn',
+            '-w', str(os.cpu_count() or 1),
+            # Sync workers are killed after the timeout, and OCR of a large scan is slow
+            '--timeout', '120',
+            '-b', '0.0.0.0:5001',
+            '--pythonpath', _HERE,
+            'app:app'
+        ])
@@ -9,10 +9,13 @@ import requests
 import json
 import time
 
+# One keep-alive connection is reused for every request to the test server
+session = requests.Session()
+
 def test_server():
     """Test if the server is running"""
     try:
-        response = requests.get('http://localhost:5000/api/health')
+        response = session.get('http://localhost:5000/api/health')
         if response.status_code == 200:
             print("✅ Server is running")
             return True
@@ -46,7 +49,7 @@ def test_multiple_file_upload():
         return False
     
     try:
-        response = requests.post('http://localhost:5000/api/upload-files', files=files)
+        response = session.post('http://localhost:5000/api/upload-files', files=files)
         
         # Close file handles
         for _, file_tuple in files:
@@ -63,6 +66,30 @@ def test_multiple_file_upload():
         print(f"❌ Upload error: {e}")
         return False
 
+def test_raw_file_upload():
+    """Test raw (streamed body) file upload functionality"""
+    print("\n🧪 Testing raw file upload...")
+    
+    if not os.path.exists('sample_invoice.txt'):
+        print("⚠️ Sample file not found for raw upload test")
+        return False
+    
+    try:
+        with open('sample_invoice.txt', 'rb') as f:
+            response = session.put('http://localhost:5000/api/upload-file/sample_invoice.txt',
+                                   data=f)
+        
+        if response.status_code == 200:
+            result = response.json()
+            print(f"✅ Raw upload successful: {result['message']}")
+            return result['files']
+        else:
+            print(f"❌ Raw upload failed: {response.text}")
+            return False
+    except Exception as e:
+        print(f"❌ Raw upload error: {e}")
+        return False
+
 def test_combined_processing(uploaded_files):
     """Test combined file processing functionality"""
     print("\n🧪 Testing combined file processing...")
@@ -83,8 +110,8 @@ def test_combined_processing(uploaded_files):
             })
     
     try:
-        response = requests.post('http://localhost:5000/api/process-combined', 
-                               json={'file_pairs': file_pairs})
+        response = session.post('http://localhost:5000/api/process-combined', 
+                              json={'file_pairs': file_pairs})
         
         if response.status_code == 200:
             result = response.json()
@@ -115,8 +142,8 @@ def test_single_file_processing():
             files = {'data_file': f}
             data = {'invoice_number': 'INV-2024-001'}
             
-            response = requests.post('http://localhost:5000/api/process', 
-                                   files=files, data=data)
+            response = session.post('http://localhost:5000/api/process', 
+                                  files=files, data=data)
         
         if response.status_code == 200:
             result = response.json()
@@ -141,7 +168,7 @@ def test_csv_download(csv_filename):
         return False
     
     try:
-        response = requests.get(f'http://localhost:5000/api/download/{csv_filename}')
+        response = session.get(f'http://localhost:5000/api/download/{csv_filename}')
         
         if response.status_code == 200:
             print(f"✅ CSV download successful")
@@ -168,15 +195,18 @@ def main():
     if not uploaded_files:
         return
     
-    # Test 3: Combined file processing
+    # Test 3: Raw file upload
+    test_raw_file_upload()
+    
+    # Test 4: Combined file processing
     combined_result = test_combined_processing(uploaded_files)
     if not combined_result:
         return
     
-    # Test 4: Single file processing
+    # Test 5: Single file processing
     single_result = test_single_file_processing()
     
-    # Test 5: CSV download
+    # Test 6: CSV download
     csv_filename = combined_result.get('download_filename')
     test_csv_download(csv_filename)
     
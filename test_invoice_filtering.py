@@ -1,39 +1,63 @@
 #!/usr/bin/env python3
 """
 TEST: Invoice Number Filtering - 4 Specific Fixes
-Tests the exact issue with invoice numbers appearing as line items
+Tests the exact issue with invoice numbers appearing as line items, plus
+regression checks for the OCR retry, line item building, file matching and
+PDF text cache against their previous behaviour
 """
 
 import sys
 import os
-import pandas as pd
+import io
+import re
+import tempfile
+from contextlib import redirect_stdout
+from functools import lru_cache
+from types import MappingProxyType
 
 # Add current directory to path
-sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _HERE)
 
-from app import (
-    extract_text_from_pdf,
-    parse_invoice_from_text,
-    extract_part_numbers_from_text,
-    process_invoice_data
-)
+# Section banner line
+BAR = "=" * 70
+
+# The app (and pandas, numpy, pytesseract with it) is imported inside each test,
+# so nothing heavy is loaded until a test actually needs it
+
+@lru_cache(maxsize=32)
+def _parse_cached(text):
+    """Parse invoice text once per distinct text (read-only, as the result is shared)"""
+    from app import parse_invoice_from_text
+    return MappingProxyType(parse_invoice_from_text(text))
+
+def run_buffered(test):
+    """Run a test, collecting its output and writing it to stdout in one go"""
+    buffer = io.StringIO()
+    try:
+        with redirect_stdout(buffer):
+            return test()
+    finally:
+        sys.stdout.write(buffer.getvalue())
 
 def print_section(title):
-    print("\n" + "="*70)
+    print("\n" + BAR)
     print(f"  {title}")
-    print("="*70)
+    print(BAR)
 
 def test_fix_1_extract_invoice_first():
     """TEST 1: Invoice number should be extracted BEFORE part numbers"""
     print_section("TEST 1: Extract Invoice Number FIRST")
     
+    from app import extract_text_from_pdf
+    
     test_pdf = "uploads/20260122_075724_Factura_Americana_de_Exportacion_-_074M-22006670.pdf"
     
     if not os.path.exists(test_pdf):
         print(f"⚠️  Test file not found: {test_pdf}")
         print("   Using alternative test with sample data")
         test_text = "Invoice Number: 074M-22006670\nPart: *214N53\nPart: 074M-22006670"
-        parsed = parse_invoice_from_text(test_text)
+        parsed = _parse_cached(test_text)
         invoice_num = parsed.get('invoice_number', 'NOT_FOUND')
     else:
         # Extract text from the PDF
@@ -41,7 +65,7 @@ def test_fix_1_extract_invoice_first():
         print(f"\n📄 Processing: {os.path.basename(test_pdf)}")
         
         # Parse invoice data
-        parsed = parse_invoice_from_text(text)
+        parsed = _parse_cached(text)
         invoice_num = parsed.get('invoice_number', 'NOT_FOUND')
     
     print(f"\n✓ Invoice number extracted: {invoice_num}")
@@ -80,7 +104,7 @@ def test_fix_2_exclude_invoice_from_parts():
     print(f"   Expected parts: 207N31, 223JCV, 230CEP")
     
     # Parse invoice data
-    parsed = parse_invoice_from_text(test_text)
+    parsed = _parse_cached(test_text)
     
     invoice_num = parsed.get('invoice_number', '')
     part_numbers = parsed.get('part_numbers', [])
@@ -89,18 +113,12 @@ def test_fix_2_exclude_invoice_from_parts():
     print(f"✓ Part Numbers Found: {len(part_numbers)}")
     print(f"✓ Parts: {part_numbers[:10]}")
     
-    # Check if invoice number appears in any part number
-    invoice_in_parts = False
+    # Check if invoice number appears in any part number, with one regex pass per part
     suspicious_parts = []
-    
-    for part in part_numbers:
-        if invoice_num and (
-            '074M' in part.upper() or 
-            '22006670' in part or
-            invoice_num.replace('-', '') in part.upper()
-        ):
-            invoice_in_parts = True
-            suspicious_parts.append(part)
+    if invoice_num:
+        suspicious = re.compile('074M|22006670|' + re.escape(invoice_num.replace('-', '')))
+        suspicious_parts = [part for part in part_numbers if suspicious.search(part.upper())]
+    invoice_in_parts = bool(suspicious_parts)
     
     if invoice_in_parts:
         print(f"\n❌ FAIL: Invoice number found in parts!")
@@ -147,8 +165,23 @@ def test_fix_4_no_invoice_line_item():
     test_pdf = "uploads/20260122_075724_Factura_Americana_de_Exportacion_-_074M-22006670.pdf"
     test_txt = "uploads/20260122_075729_NPD00357356.txt"
     
+    # Check each file once; with neither present there is nothing to process
+    pdf_exists = os.path.exists(test_pdf)
+    txt_exists = os.path.exists(test_txt)
+    
+    # Processing the PDF can run Tesseract OCR, which takes seconds; only do it when asked
+    if pdf_exists and not os.environ.get('RUN_OCR_TESTS'):
+        print(f"\n⚠️  Skipping PDF: {os.path.basename(test_pdf)} (set RUN_OCR_TESTS=1 to test it)")
+        pdf_exists = False
+    
+    if not pdf_exists and not txt_exists:
+        print("\n⚠️  No test files to process, skipping")
+        return True
+    
+    from app import process_invoice_data
+    
     # Test PDF processing
-    if os.path.exists(test_pdf):
+    if pdf_exists:
         print(f"\n📄 Testing PDF: {os.path.basename(test_pdf)}")
         
         try:
@@ -161,15 +194,13 @@ def test_fix_4_no_invoice_line_item():
                 print(f"   Line items should come from TXT file")
             elif len(pdf_df) > 0:
                 # Check SKU column for invoice number
-                skus = pdf_df['SKU'].astype(str).tolist()
+                # (kept as a Series; only the printed SKUs become a list)
+                sku_series = pdf_df['SKU'].astype(str)
                 print(f"⚠️  WARNING: PDF created {len(pdf_df)} rows")
-                print(f"   SKUs: {skus[:5]}")
+                print(f"   SKUs: {sku_series.head(5).tolist()}")
                 
                 # Check if invoice number is in SKU
-                invoice_in_sku = any(
-                    '074M' in str(sku) or '22006670' in str(sku) 
-                    for sku in skus
-                )
+                invoice_in_sku = sku_series.str.contains('074M|22006670', regex=True, na=False).any()
                 
                 if invoice_in_sku:
                     print(f"❌ FAIL: Invoice number found in SKU column!")
@@ -180,7 +211,7 @@ def test_fix_4_no_invoice_line_item():
             print(f"⚠️  PDF processing error: {e}")
     
     # Test TXT processing
-    if os.path.exists(test_txt):
+    if txt_exists:
         print(f"\n📄 Testing TXT: {os.path.basename(test_txt)}")
         
         try:
@@ -189,19 +220,19 @@ def test_fix_4_no_invoice_line_item():
             print(f"✓ TXT created {len(txt_df)} rows")
             
             if len(txt_df) > 0:
-                skus = txt_df['SKU'].astype(str).tolist()
-                print(f"✓ First 10 SKUs: {skus[:10]}")
+                sku_series = txt_df['SKU'].astype(str)
+                print(f"✓ First 10 SKUs: {sku_series.head(10).tolist()}")
                 
                 # Check if invoice number is in any SKU
-                invoice_in_sku = any(
-                    '074M-22006670' == str(sku) or
-                    '074M22006670' == str(sku)
-                    for sku in skus
-                )
+                invoice_in_sku = sku_series.isin(['074M-22006670', '074M22006670']).any()
                 
                 if invoice_in_sku:
                     print(f"❌ FAIL: Invoice number found as a SKU in TXT!")
-                    matching_skus = [s for s in skus if '074M' in str(s) and '22006670' in str(s)]
+                    matching = (
+                        sku_series.str.contains('074M', regex=False, na=False) &
+                        sku_series.str.contains('22006670', regex=False, na=False)
+                    )
+                    matching_skus = sku_series[matching].tolist()
                     print(f"   Matching SKUs: {matching_skus}")
                     return False
                 else:
@@ -213,18 +244,317 @@ def test_fix_4_no_invoice_line_item():
     
     return True
 
+def test_ocr_retry_threshold():
+    """TEST 5: The high-DPI OCR retry only runs when the whole document lacks part numbers"""
+    print_section("TEST 5: OCR Retry Threshold")
+    
+    import app
+    
+    # Stand-in for rendering and OCR: canned page texts per DPI, recording each pass
+    passes = []
+    pages = {}
+    def fake_ocr(pdf, page_indexes, dpi):
+        passes.append(dpi)
+        return [pages[dpi][i] for i in page_indexes]
+    
+    cases = [
+        # (description, first pass, retry pass, text-layer candidates, expect retry, expected result)
+        ("Parts on one page, blank pages elsewhere",
+         ["*207N31 Component A", "", "Terms and conditions"], None, 0, False,
+         ["*207N31 Component A", "", "Terms and conditions"]),
+        ("No parts anywhere in the document",
+         ["", "blurry", ""], ["", "*223JCV Component B", ""], 0, True,
+         ["", "*223JCV Component B", ""]),
+        ("No parts in OCR, but some in the text layer",
+         ["", "", ""], None, app.OCR_RETRY_MIN_PART_CANDIDATES, False,
+         ["", "", ""]),
+    ]
+    
+    original = app._ocr_rendered_pages
+    app._ocr_rendered_pages = fake_ocr
+    all_passed = True
+    try:
+        for description, first, retry, known, expect_retry, expected in cases:
+            pages.update({app.OCR_DPI: first, app.OCR_RETRY_DPI: retry})
+            passes.clear()
+            result = app._ocr_pdf_pages(None, list(range(len(first))), known)
+            retried = app.OCR_RETRY_DPI in passes
+            
+            if retried == expect_retry and result == expected:
+                print(f"✅ {description}: {'retried' if retried else 'no retry'}")
+            else:
+                print(f"❌ {description}: retried={retried}, result={result}")
+                all_passed = False
+    finally:
+        app._ocr_rendered_pages = original
+    
+    if all_passed:
+        print(f"\n✅ PASS: Retry threshold of {app.OCR_RETRY_MIN_PART_CANDIDATES} applied per document")
+    else:
+        print("\n❌ FAIL: OCR retry threshold not applied per document")
+    return all_passed
+
+def _row_wise_line_items(source_df):
+    """Line items built row by row, as process_invoice_data did before build_line_items"""
+    import pandas as pd
+    
+    output_data = []
+    for idx, row in source_df.iterrows():
+        qty = float(row.get('quantity', 0)) if pd.notna(row.get('quantity', 0)) else 0.0
+        unit_price = float(row.get('AMT', 0)) if pd.notna(row.get('AMT', 0)) else 0.0
+        weight = float(row.get('WEIGHT', 0)) if pd.notna(row.get('WEIGHT', 0)) else 0.0
+        
+        output_data.append({
+            'SKU': str(row.get('PART', '')).strip(),
+            'DESCRIPTION': str(row.get('PART_DESC', '')).strip(),
+            'HTS': str(row.get('HTTS', '')).strip(),
+            'COUNTRY OF ORIGIN': str(row.get('C/N', '')).strip(),
+            'NO. OF PACKAGE': '',
+            'QUANTITY': qty,
+            'NET WEIGHT': weight,
+            'GROSS WEIGHT': weight,
+            'UNIT PRICE': unit_price,
+            'VALUE': qty * unit_price,
+            'QTY UNIT': 'EA'
+        })
+    
+    return pd.DataFrame(output_data)
+
+def test_line_items_match_row_wise():
+    """TEST 6: Column-wise line items match the previous row-wise output"""
+    print_section("TEST 6: Line Items Match Row-Wise Output")
+    
+    import pandas as pd
+    from app import process_invoice_data
+    
+    full = pd.DataFrame({
+        'invoice_nbr': ['INV-1', 'INV-1', 'INV-2'],
+        'PART': [' *207N31 ', '223JCV', None],
+        'PART_DESC': ['Component A', None, 'Component C'],
+        'HTTS': ['8536.50', '8536.50', ''],
+        'C/N': ['US', 'MX', 'CN'],
+        'quantity': [2, None, 5],
+        'AMT': [1.5, 3.0, None],
+        'WEIGHT': [0.25, 1.0, None],
+    })
+    cases = [
+        ("All columns", full, None),
+        ("Filtered by invoice number", full, 'INV-2'),
+        ("Empty frame", full.iloc[0:0], None),
+        ("Missing columns", full[['invoice_nbr', 'PART', 'quantity']], None),
+    ]
+    
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for description, source_df, invoice_number in cases:
+            # Missing columns only happen in CSV exports; the TXT route requires them all
+            file_types = ['csv'] if len(source_df.columns) < len(full.columns) else ['csv', 'txt']
+            for file_type in file_types:
+                path = os.path.join(tmp, f"data.{file_type}")
+                source_df.to_csv(path, sep='\t' if file_type == 'txt' else ',', index=False)
+                
+                read_df = pd.read_csv(path, sep='\t' if file_type == 'txt' else ',', index_col=False)
+                if invoice_number:
+                    read_df = read_df[read_df['invoice_nbr'] == invoice_number]
+                expected = _row_wise_line_items(read_df)
+                result = process_invoice_data(path, file_type, invoice_number)
+                
+                # The row-wise version produced a frame without columns when there were no rows
+                same = (result.empty and expected.empty) or (
+                    list(result.columns) == list(expected.columns)
+                    and result.to_dict('records') == expected.to_dict('records')
+                )
+                if same:
+                    print(f"✅ {description} ({file_type}): {len(result)} rows match")
+                else:
+                    print(f"❌ {description} ({file_type}): output differs")
+                    print(f"   Expected: {expected.to_dict('records')}")
+                    print(f"   Got:      {result.to_dict('records')}")
+                    all_passed = False
+    
+    if all_passed:
+        print("\n✅ PASS: Line items unchanged by column-wise building")
+    else:
+        print("\n❌ FAIL: Line items differ from the row-wise output")
+    return all_passed
+
+def _pairwise_matches(pdf_files, txt_files):
+    """PDF/TXT matching by comparing every pair of files, as done before the score matrix"""
+    import app
+    
+    matches = []
+    for pdf_file in pdf_files:
+        pdf_text = app.extract_text_from_pdf(pdf_file['filepath'])
+        invoice_number = app.parse_invoice_from_text(pdf_text).get('invoice_number')
+        pdf_part_numbers = app.extract_part_numbers_from_text(pdf_text, invoice_number=invoice_number)
+        
+        best_match = None
+        max_matches = 0
+        if not pdf_part_numbers and txt_files:
+            best_match = txt_files[0]
+            max_matches = 1
+        
+        if not best_match:
+            for txt_file in txt_files:
+                txt_part_numbers = app.extract_part_numbers_from_txt_file(txt_file['filepath'])
+                pdf_normalized = {p.replace('*', '').upper() for p in pdf_part_numbers}
+                txt_normalized = {p.replace('*', '').upper() for p in txt_part_numbers}
+                matches_count = len(pdf_normalized & txt_normalized)
+                if matches_count > max_matches:
+                    max_matches = matches_count
+                    best_match = txt_file
+        
+        matches.append({
+            'pdf': pdf_file,
+            'txt': best_match,
+            'match_score': max_matches,
+            'pdf_parts': pdf_part_numbers,
+            'txt_parts': app.extract_part_numbers_from_txt_file(best_match['filepath']) if best_match else [],
+            'pdf_has_text': len(pdf_part_numbers) > 0
+        })
+    return matches
+
+def test_part_matching_matches_pairwise():
+    """TEST 7: Matrix-based file matching picks the same files as pairwise comparison"""
+    print_section("TEST 7: File Matching Matches Pairwise Comparison")
+    
+    import app
+    
+    # File contents are served from memory so no real PDFs are needed
+    pdf_texts = {
+        'a.pdf': "Invoice Number: 074M-22006670\n*207N31 *223JCV *230CEP",
+        'b.pdf': "Invoice Number: 074M-22006671\n*999ZZZ",
+        'c.pdf': "",
+        'd.pdf': "Invoice Number: 074M-22006672\n*207N31 *214N53",
+        'e.pdf': "Invoice Number: 074M-22006673\n*223JCV",
+    }
+    txt_parts = {
+        'x.txt': ['207n31', '*223JCV'],
+        'y.txt': ['207N31', '223JCV', '230CEP'],
+        'z.txt': ['214N53', '207N31'],
+    }
+    cases = [
+        ("Best, tied, fallback and unmatched PDFs", list(pdf_texts), list(txt_parts)),
+        ("No TXT files", list(pdf_texts), []),
+        ("Only PDFs without parts", ['c.pdf'], list(txt_parts)),
+    ]
+    
+    originals = (app.extract_text_from_pdf, app.extract_part_numbers_from_txt_file)
+    app.extract_text_from_pdf = pdf_texts.__getitem__
+    app.extract_part_numbers_from_txt_file = txt_parts.__getitem__
+    all_passed = True
+    try:
+        for description, pdf_names, txt_names in cases:
+            pdf_files = [{'filepath': name, 'type': 'pdf'} for name in pdf_names]
+            txt_files = [{'filepath': name, 'type': 'txt'} for name in txt_names]
+            
+            expected = _pairwise_matches(pdf_files, txt_files)
+            result = app.match_files_by_part_numbers(pdf_files, txt_files)
+            
+            if result == expected:
+                print(f"✅ {description}: {[m['txt'] and m['txt']['filepath'] for m in result]}")
+            else:
+                print(f"❌ {description}: matches differ")
+                print(f"   Expected: {expected}")
+                print(f"   Got:      {result}")
+                all_passed = False
+    finally:
+        app.extract_text_from_pdf, app.extract_part_numbers_from_txt_file = originals
+    
+    if all_passed:
+        print("\n✅ PASS: Same matches as pairwise comparison")
+    else:
+        print("\n❌ FAIL: Matches differ from pairwise comparison")
+    return all_passed
+
+def test_pdf_text_cache():
+    """TEST 8: PDF text cache hits, misses, corrupt files and incomplete extractions"""
+    print_section("TEST 8: PDF Text Cache")
+    
+    import app
+    
+    # Stand-in extraction: returns canned (text, complete) results and counts the calls
+    calls = []
+    results = {}
+    def fake_extract(file_path):
+        calls.append(file_path)
+        return results[file_path]
+    
+    def clear_memo():
+        with app._PDF_TEXT_MEMO_LOCK:
+            app._pdf_text_memo.clear()
+    
+    originals = (app._extract_text_from_pdf_uncached, app.PDF_TEXT_CACHE_FOLDER)
+    all_passed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        app._extract_text_from_pdf_uncached = fake_extract
+        app.PDF_TEXT_CACHE_FOLDER = tmp
+        clear_memo()
+        try:
+            complete_pdf = os.path.join(tmp, 'complete.pdf')
+            partial_pdf = os.path.join(tmp, 'partial.pdf')
+            for path, content in ((complete_pdf, b'complete'), (partial_pdf, b'partial')):
+                with open(path, 'wb') as file:
+                    file.write(content)
+            results[complete_pdf] = ("*207N31 Component A", True)
+            results[partial_pdf] = ("text layer only", False)
+            cache_file = os.path.join(tmp, f"{app.file_digest(complete_pdf)}.txt")
+            
+            def corrupt_cache():
+                clear_memo()
+                with open(cache_file, 'wb') as file:
+                    file.write(b'\xff\xfe truncated')
+            
+            steps = [
+                # (description, setup, file, expected extraction calls so far)
+                ("Miss extracts and stores", None, complete_pdf, 1),
+                ("Memory hit", None, complete_pdf, 1),
+                ("Disk hit after memory is cleared", clear_memo, complete_pdf, 1),
+                ("Corrupt cache file is a miss", corrupt_cache, complete_pdf, 2),
+                ("Rewritten cache file hits", clear_memo, complete_pdf, 2),
+                ("Incomplete extraction", None, partial_pdf, 3),
+                ("Incomplete extraction is not cached", None, partial_pdf, 4),
+            ]
+            for description, setup, path, expected_calls in steps:
+                if setup:
+                    setup()
+                text = app.extract_text_from_pdf(path)
+                if text == results[path][0] and len(calls) == expected_calls:
+                    print(f"✅ {description}")
+                else:
+                    print(f"❌ {description}: text={text!r}, extractions={len(calls)} (expected {expected_calls})")
+                    all_passed = False
+            
+            with open(cache_file, encoding='utf-8') as file:
+                if file.read() != results[complete_pdf][0]:
+                    print("❌ Cache file does not hold the extracted text")
+                    all_passed = False
+        finally:
+            app._extract_text_from_pdf_uncached, app.PDF_TEXT_CACHE_FOLDER = originals
+            clear_memo()
+    
+    if all_passed:
+        print("\n✅ PASS: Only complete extractions are cached, corrupt entries are replaced")
+    else:
+        print("\n❌ FAIL: PDF text cache misbehaved")
+    return all_passed
+
 def run_all_tests():
-    """Run all 4 tests"""
+    """Run all tests"""
     print("\n" + "🧪"*35)
     print("TESTING INVOICE NUMBER FILTERING FIXES")
     print("Invoice: 074M-22006670")
     print("🧪"*35)
     
     results = {
-        "Test 1: Extract Invoice First": test_fix_1_extract_invoice_first(),
-        "Test 2: Exclude from Parts": test_fix_2_exclude_invoice_from_parts(),
-        "Test 3: Include in Filename": test_fix_3_filename_includes_invoice(),
-        "Test 4: No Line Item Created": test_fix_4_no_invoice_line_item()
+        "Test 1: Extract Invoice First": run_buffered(test_fix_1_extract_invoice_first),
+        "Test 2: Exclude from Parts": run_buffered(test_fix_2_exclude_invoice_from_parts),
+        "Test 3: Include in Filename": run_buffered(test_fix_3_filename_includes_invoice),
+        "Test 4: No Line Item Created": run_buffered(test_fix_4_no_invoice_line_item),
+        "Test 5: OCR Retry Threshold": run_buffered(test_ocr_retry_threshold),
+        "Test 6: Line Items Match Row-Wise": run_buffered(test_line_items_match_row_wise),
+        "Test 7: Matching Matches Pairwise": run_buffered(test_part_matching_matches_pairwise),
+        "Test 8: PDF Text Cache": run_buffered(test_pdf_text_cache)
     }
     
     # Summary
@@ -237,9 +567,9 @@ def run_all_tests():
         status = "✅ PASS" if passed_test else "❌ FAIL"
         print(f"{status}  {test_name}")
     
-    print(f"\n{'='*70}")
+    print(f"\n{BAR}")
     print(f"RESULTS: {passed}/{total} tests passed ({int(passed/total*100)}%)")
-    print(f"{'='*70}")
+    print(f"{BAR}")
     
     if passed == total:
         print("\n🎉 ALL TESTS PASSED! Fixes are working correctly.")
@@ -248,6 +578,9 @@ def run_all_tests():
         print("   2. Invoice numbers are excluded from part number extraction")
         print("   3. Invoice numbers are included in output filenames")
         print("   4. Invoice numbers don't create fake line items")
+        print("   5. Scans are only OCR'd again at high DPI when they lack part numbers")
+        print("   6. Line items and file matches are unchanged by the faster implementations")
+        print("   7. Only complete PDF text extractions are cached")
     else:
         print(f"\n⚠️  {total - passed} test(s) failed. Review results above.")
     